@@ -1,47 +1,426 @@
+import logging
+import math
+import time
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    # Numba is an optional accelerator; fall back to the plain function.
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        def wrap(func):
+            return func
+        return wrap
+
+# Per-event reporting goes through logging, not print: a debug-level call is
+# a near no-op unless a handler is configured, so the frame loop never blocks
+# on stdout I/O.
+log = logging.getLogger("blink")
+
+# Physiological plausibility bounds for a blink. Shorter closures are noise,
+# longer ones are deliberate eye closure, not blinks.
+MIN_BLINK_SEC = 0.05
+MAX_BLINK_SEC = 0.8
+
+# Length of the sliding window (seconds) the rolling metrics cover
+WINDOW_SIZE_SEC = 30.0
+
+# Blinks closer together than this (seconds) belong to the same burst
+BURST_GAP_SEC = 2.0
+
+# Precomputed at import so the rate calculation is a multiply, not a divide
+_BLINKS_TO_PER_MIN = 60.0 / WINDOW_SIZE_SEC
+
+# How stale cached metrics may get before a recompute is forced even with
+# no blink activity (keeps the time-windowed values drifting forward)
+_METRICS_REFRESH_SEC = 1.0
+
+# Short Gaussian (std=1 frame) convolved over the recent EAR trace before
+# thresholding: removes single-frame jitter that flips the state machine
+# without flattening the blink waveform itself. Built with plain NumPy so
+# no scipy dependency is needed for a 5-tap kernel.
+_SMOOTH_K = 5
+_g = np.exp(-0.5 * (np.arange(_SMOOTH_K) - (_SMOOTH_K - 1) / 2.0) ** 2)
+_GAUSS_KERNEL = (_g / _g.sum()).astype(np.float32)
+del _g
+
+# Fixed capacity of the event ring buffers. The window can hold at most
+# WINDOW_SIZE_SEC x max plausible blink rate events, far below this, so the
+# ring never wraps onto live data and the detector allocates nothing after
+# construction.
+_RING_CAPACITY = 512
+
+# Capacity of the open-eye EAR sample rings: 30 FPS x 30s window = 900
+# live samples worst case, so 2048 slots never wrap onto live data
+_EAR_RING_CAPACITY = 2048
+
+@njit(cache=True)
+def _update_core(left_ear, right_ear, counter, total_blinks, threshold, consec_frames):
+    """
+    Hot scalar core of the blink state machine, kept free of object access
+    so Numba can compile it to native code. Returns the new counter, new
+    blink total, and whether the eyes are currently closed.
+    """
+    # Both eyes closed == the more-open eye is below threshold; one compare,
+    # no short-circuit branch on a noisy signal near the threshold
+    is_closed = max(left_ear, right_ear) < threshold
+
+    if is_closed:
+        counter += 1
+    else:
+        # Check if eyes were closed long enough before opening
+        if counter >= consec_frames:
+            total_blinks += 1
+        counter = 0
+
+    return counter, total_blinks, is_closed
+
 class BlinkDetector:
     """
     A state machine to detect blinks based on Eye Aspect Ratio (EAR) thresholds.
+
+    Accepted blinks are recorded in Structure-of-Arrays form: two parallel
+    NumPy buffers (start timestamp, duration) with a tail count, so the
+    rolling metrics reduce over contiguous slices with vectorized NumPy ops
+    instead of iterating a growing list of Python objects.
     """
+    __slots__ = ("threshold", "consec_frames", "counter", "total_blinks",
+                 "discarded_closures",
+                 "starts", "durs", "head", "tail", "_dur_sum", "_dur_sqsum",
+                 "_ear_ts", "_ear_val", "_ear_head", "_ear_tail",
+                 "_ear_sum", "_ear_sqsum",
+                 "_last_cleanup_t", "_closure_start",
+                 "_last_metrics", "_last_metrics_t", "_metrics_dirty",
+                 "_ear_hist", "_hist_primed")
+
     def __init__(self, threshold=0.22, consec_frames=3):
         """
         Initialize the detector.
-        
+
         Args:
             threshold (float): EAR value below which the eyes are considered closed.
-            consec_frames (int): Minimum number of consecutive frames of closure 
+            consec_frames (int): Minimum number of consecutive frames of closure
                                 to register a valid blink.
         """
         self.threshold = threshold
         self.consec_frames = consec_frames
-        
+
         self.counter = 0
         self.total_blinks = 0
 
-    def update(self, left_ear, right_ear):
+        # Closures rejected by the plausibility filter; a counter callers
+        # can poll instead of per-event output on the frame loop
+        self.discarded_closures = 0
+
+        # SoA event storage as fixed-capacity ring buffers. head/tail are
+        # monotonically increasing event counters; slot i lives at
+        # i % _RING_CAPACITY. Expiry advances head (O(expired)) and appends
+        # never reallocate.
+        self.starts = np.empty(_RING_CAPACITY, np.float64)
+        self.durs = np.empty(_RING_CAPACITY, np.float32)
+        self.head = 0
+        self.tail = 0
+
+        # Running sums over the live window so mean/variance are O(1) to
+        # read: adding a sample or retiring an expired one adjusts the sums
+        # instead of recomputing over the whole window.
+        self._dur_sum = 0.0
+        self._dur_sqsum = 0.0
+
+        # Open-eye EAR samples for the EAR stability index, in the same
+        # head/tail ring layout as the blink buffers, with running sums.
+        # Zero allocation per sample regardless of session length.
+        self._ear_ts = np.empty(_EAR_RING_CAPACITY, np.float64)
+        self._ear_val = np.empty(_EAR_RING_CAPACITY, np.float32)
+        self._ear_head = 0
+        self._ear_tail = 0
+        self._ear_sum = 0.0
+        self._ear_sqsum = 0.0
+
+        # Timestamp of the last expiry pass; lets every entry point share
+        # one cleanup per frame instead of re-walking the window
+        self._last_cleanup_t = -1.0
+
+        # Rolling EAR history (row 0 left, row 1 right) for the Gaussian
+        # pre-threshold smoothing; primed with the first real sample
+        self._ear_hist = np.zeros((2, _SMOOTH_K), np.float32)
+        self._hist_primed = False
+
+        self._closure_start = 0.0
+
+        # get_metrics cache: recomputed only when blink events changed
+        # (dirty flag) or the cache outlived _METRICS_REFRESH_SEC. EAR
+        # sample churn deliberately does not dirty the cache — the ESI
+        # drifts slowly and the refresh interval keeps it current.
+        self._last_metrics = None
+        self._last_metrics_t = -1.0
+        self._metrics_dirty = True
+
+    def update(self, left_ear, right_ear, current_time=None):
         """
         Update the state machine with the latest EAR values.
         A blink is only counted on the closed -> open transition to ensure robustness.
         Both eyes must be closed simultaneously to avoid false positives from winks.
-        
+
         Args:
             left_ear (float): EAR for the left eye.
             right_ear (float): EAR for the right eye.
-            
+            current_time (float): Monotonic timestamp of the frame; defaults
+                                  to time.monotonic().
+
         Returns:
             bool: True if eyes are currently detected as closed (for visual feedback).
         """
-        is_closed = left_ear < self.threshold and right_ear < self.threshold
-        
-        if is_closed:
-            self.counter += 1
+        if current_time is None:
+            current_time = time.monotonic()
+
+        # Gaussian-smooth both EAR traces before thresholding so one noisy
+        # frame can't flip the state machine
+        hist = self._ear_hist
+        if not self._hist_primed:
+            hist[0, :] = left_ear
+            hist[1, :] = right_ear
+            self._hist_primed = True
         else:
-            # Check if eyes were closed long enough before opening
-            if self.counter >= self.consec_frames:
-                self.total_blinks += 1
-            self.counter = 0
-            
+            hist[:, :-1] = hist[:, 1:]
+            hist[0, -1] = left_ear
+            hist[1, -1] = right_ear
+        left_smooth, right_smooth = hist @ _GAUSS_KERNEL
+
+        prev_counter = self.counter
+        prev_total = self.total_blinks
+        self.counter, self.total_blinks, is_closed = _update_core(
+            float(left_smooth), float(right_smooth), self.counter, self.total_blinks,
+            self.threshold, self.consec_frames)
+
+        if is_closed and prev_counter == 0:
+            self._closure_start = current_time
+
+        if not is_closed:
+            avg_ear = (left_ear + right_ear) / 2.0
+            if self._ear_tail - self._ear_head == _EAR_RING_CAPACITY:
+                self._retire_ear_head()
+            idx = self._ear_tail % _EAR_RING_CAPACITY
+            self._ear_ts[idx] = current_time
+            self._ear_val[idx] = avg_ear
+            self._ear_tail += 1
+            self._ear_sum += avg_ear
+            self._ear_sqsum += avg_ear * avg_ear
+
+        self._expire_window(current_time)
+
+        if self.total_blinks != prev_total:
+            duration = current_time - self._closure_start
+            if MIN_BLINK_SEC <= duration <= MAX_BLINK_SEC:
+                self._record_blink(self._closure_start, duration)
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Blink %d registered (%.0fms)", self.total_blinks, duration * 1000)
+            else:
+                self.total_blinks = prev_total
+                self.discarded_closures += 1
+                if log.isEnabledFor(logging.DEBUG):
+                    log.debug("Discarded closure: %.0fms", duration * 1000)
+
         return is_closed
 
+    def _record_blink(self, start, duration):
+        """Append one blink to the ring buffers, dropping the oldest if full."""
+        if self.tail - self.head == _RING_CAPACITY:
+            self._retire_blink_head()
+        idx = self.tail % _RING_CAPACITY
+        self.starts[idx] = start
+        self.durs[idx] = duration
+        self.tail += 1
+        self._dur_sum += duration
+        self._dur_sqsum += duration * duration
+        self._metrics_dirty = True
+
+    def _expire_window(self, current_time):
+        """
+        Retire every event that slid out of the window, adjusting the
+        running sums. Guarded so update() and the metric entry points
+        called with the same timestamp share a single cleanup pass.
+        """
+        if current_time == self._last_cleanup_t:
+            return
+        self._last_cleanup_t = current_time
+
+        while (self.head < self.tail
+               and current_time - self.starts[self.head % _RING_CAPACITY] > WINDOW_SIZE_SEC):
+            self._retire_blink_head()
+
+        while (self._ear_head < self._ear_tail
+               and current_time - self._ear_ts[self._ear_head % _EAR_RING_CAPACITY] > WINDOW_SIZE_SEC):
+            self._retire_ear_head()
+
+    def _retire_blink_head(self):
+        """Drop the oldest blink event, adjusting the running sums."""
+        dur = float(self.durs[self.head % _RING_CAPACITY])
+        self._dur_sum -= dur
+        self._dur_sqsum -= dur * dur
+        self.head += 1
+        self._metrics_dirty = True
+
+    def _retire_ear_head(self):
+        """Drop the oldest EAR sample, adjusting the running sums."""
+        ear = float(self._ear_val[self._ear_head % _EAR_RING_CAPACITY])
+        self._ear_sum -= ear
+        self._ear_sqsum -= ear * ear
+        self._ear_head += 1
+
+    def _window_starts(self):
+        """
+        Return the live window's start timestamps as one contiguous array.
+
+        Durations are never materialized here: their mean/variance come
+        from the running sums, so the timing metrics are the only ones
+        that need an array view.
+        """
+        lo = self.head % _RING_CAPACITY
+        hi = self.tail % _RING_CAPACITY
+        if self.head == self.tail:
+            return self.starts[:0]
+        if lo < hi:
+            return self.starts[lo:hi]
+        # Window wraps the end of the ring; stitch the two runs together
+        return np.concatenate([self.starts[lo:], self.starts[:hi]])
+
+    def get_metrics(self, current_time):
+        """
+        Compute rolling blink statistics over the most recent events.
+
+        Args:
+            current_time (float): Monotonic timestamp of the current frame.
+
+        Returns:
+            dict: blink_rate (blinks/min), mean_duration (s), duration_var
+                  (s^2), ibi (mean inter-blink interval, s), bbi (blink
+                  bursts per blink), and esi (EAR stability index: std of
+                  open-eye EAR) over the last WINDOW_SIZE_SEC seconds.
+
+        Callers poll this every frame, but the cached dict is returned
+        untouched unless a blink event entered or left the window (dirty
+        flag) or the cache is older than _METRICS_REFRESH_SEC, so in the
+        common no-blink case this is a single attribute check.
+        """
+        if (not self._metrics_dirty
+                and current_time - self._last_metrics_t < _METRICS_REFRESH_SEC):
+            return self._last_metrics
+
+        self._expire_window(current_time)
+
+        # EAR stability index: std of open-eye EAR, straight from the sums
+        n_ear = self._ear_tail - self._ear_head
+        if n_ear:
+            ear_mean = self._ear_sum / n_ear
+            esi = math.sqrt(max(0.0, self._ear_sqsum / n_ear - ear_mean * ear_mean))
+        else:
+            esi = 0.0
+
+        if self.head == self.tail:
+            metrics = {"blink_rate": 0.0, "mean_duration": 0.0,
+                       "duration_var": 0.0, "ibi": 0.0, "bbi": 0.0,
+                       "esi": esi}
+        else:
+            count = self.tail - self.head
+            mean_duration = self._dur_sum / count
+            duration_var = max(0.0, self._dur_sqsum / count - mean_duration * mean_duration)
+
+            # IBI and BBI share one gap array: a single diff over the
+            # window's start timestamps feeds both, and the burst count is
+            # the rising edges of "gap <= BURST_GAP_SEC" (first close gap
+            # always opens a burst, later ones only after an open gap)
+            starts = self._window_starts()
+            if count > 1:
+                d_ts = np.diff(starts)
+                ibi = float(d_ts.mean())
+                close = d_ts <= BURST_GAP_SEC
+                bursts = int(close[0]) + int(np.count_nonzero(close[1:] & ~close[:-1]))
+                bbi = bursts / count
+            else:
+                ibi = 0.0
+                bbi = 0.0
+
+            metrics = {
+                "blink_rate": count * _BLINKS_TO_PER_MIN,
+                "mean_duration": mean_duration,
+                "duration_var": duration_var,
+                "ibi": ibi,
+                "bbi": bbi,
+                "esi": esi,
+            }
+
+        self._last_metrics = metrics
+        self._last_metrics_t = current_time
+        self._metrics_dirty = False
+        return metrics
+
+    @staticmethod
+    def detect_batch(ear_trace, fps):
+        """
+        Detect blinks offline over a full recorded EAR trace.
+
+        Rather than replaying the per-frame state machine, this works on
+        the signal's derivative: a blink is a sharp negative spike in
+        d(EAR)/dt (closure) followed by a sharp positive spike (reopening).
+        Candidate extrema come from scipy's find_peaks, are separated from
+        noise by 2-means clustering of their magnitudes, and are then
+        paired into blink windows. The whole trace is processed with
+        vectorized calls, so recorded sessions analyze orders of magnitude
+        faster than sample-at-a-time interpretation.
+
+        Requires scipy and scikit-learn, imported lazily — the live
+        pipeline never needs them.
+
+        Args:
+            ear_trace: 1-D array-like of average EAR samples.
+            fps (float): Sample rate of the trace in frames per second.
+
+        Returns:
+            list: (t_start, t_end, duration) tuples in seconds, filtered to
+                  physiologically plausible durations.
+        """
+        from scipy.signal import find_peaks
+        from sklearn.cluster import KMeans
+
+        # float32 is plenty for EAR values in [0,1] and halves the memory
+        # traffic of the whole-trace gradient/peak passes
+        ear = np.ascontiguousarray(ear_trace, dtype=np.float32)
+        if ear.size < 3:
+            return []
+
+        d = np.gradient(ear)
+        neg_peaks, _ = find_peaks(-d)
+        pos_peaks, _ = find_peaks(d)
+        if neg_peaks.size == 0 or pos_peaks.size == 0:
+            return []
+
+        # Split extrema into blink-related vs noise by clustering magnitudes
+        mags = np.abs(np.concatenate([d[neg_peaks], d[pos_peaks]]))
+        km = KMeans(n_clusters=2, n_init=10, random_state=0).fit(mags.reshape(-1, 1))
+        blink_label = int(np.argmax(km.cluster_centers_.ravel()))
+        neg_sig = neg_peaks[km.labels_[:neg_peaks.size] == blink_label]
+        pos_sig = pos_peaks[km.labels_[neg_peaks.size:] == blink_label]
+
+        # Pair each closure spike with the next reopening spike
+        events = []
+        j = 0
+        for i in neg_sig:
+            while j < pos_sig.size and pos_sig[j] <= i:
+                j += 1
+            if j == pos_sig.size:
+                break
+            t_start = i / fps
+            t_end = pos_sig[j] / fps
+            duration = t_end - t_start
+            if MIN_BLINK_SEC <= duration <= MAX_BLINK_SEC:
+                events.append((t_start, t_end, duration))
+                j += 1
+        return events
+
     def reset_total(self):
         """Reset the total blink count."""
         self.total_blinks = 0
@@ -1,5 +1,18 @@
+import math
+
 import numpy as np
 
+try:
+    from numba import njit
+except ImportError:
+    # Numba is an optional accelerator; fall back to the plain function.
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        def wrap(func):
+            return func
+        return wrap
+
 # MediaPipe standard landmark indices for eyes
 LEFT_EYE = [362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385, 384, 398]
 RIGHT_EYE = [33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246]
@@ -11,44 +24,135 @@ L_VERTICAL = [(385, 380), (387, 373)]
 R_HORIZONTAL = [33, 133]
 R_VERTICAL = [(160, 144), (158, 153)]
 
+# Distance-pair index table for the vectorized EAR path: one row per pair,
+# laid out as (p1,p4), (p2,p6), (p3,p5) for the left eye then the right eye.
+# Indexing pts with it yields a (6, 2, 2) = (pair, endpoint, xy) array.
+EAR_INDEX_TABLE = np.array(
+    [L_HORIZONTAL] + [list(pair) for pair in L_VERTICAL]
+    + [R_HORIZONTAL] + [list(pair) for pair in R_VERTICAL],
+    dtype=np.int32
+)
+
+# All eye contour landmarks, as one index array for vectorized visualization
+EYE_VIS_IDX = np.array(LEFT_EYE + RIGHT_EYE, dtype=np.int32)
+
+def landmarks_to_ndarray(landmarks):
+    """
+    Convert a sequence of MediaPipe landmarks to an (N, 2) float32 NumPy array.
+
+    Called once per frame so that the EAR math and the visualization both
+    index a plain array instead of repeating hundreds of per-landmark
+    attribute lookups (.x / .y). Accepts the landmark list from the Tasks
+    FaceLandmarker result (or any sequence of objects with .x / .y).
+
+    Args:
+        landmarks: Sequence of normalized landmarks.
+
+    Returns:
+        np.ndarray: (N, 2) array of normalized (x, y) coordinates.
+    """
+    return np.array([(p.x, p.y) for p in landmarks], dtype=np.float32)
+
+@njit(cache=True, fastmath=True)
+def _ears_core(c):
+    """
+    Compute (left_ear, right_ear) from the gathered (6, 2, 2) pair array.
+
+    Plain scalar arithmetic over the six distance pairs, so Numba compiles
+    it to one native kernel with no NumPy ufunc dispatch per call. The
+    distances use sqrt(dx*dx + dy*dy) rather than math.hypot: hypot
+    promotes to double even on float32 inputs, while this form keeps the
+    whole formula in single precision under the JIT. Its overflow
+    protection is irrelevant at pixel-coordinate magnitudes, and EAR is a
+    ratio of comparable distances, so FP32 precision is far beyond the
+    landmark jitter.
+    """
+
+    # Distances for [L_horiz, L_vert1, L_vert2, R_horiz, R_vert1, R_vert2]
+    x0 = c[0, 0, 0] - c[0, 1, 0]; y0 = c[0, 0, 1] - c[0, 1, 1]
+    x1 = c[1, 0, 0] - c[1, 1, 0]; y1 = c[1, 0, 1] - c[1, 1, 1]
+    x2 = c[2, 0, 0] - c[2, 1, 0]; y2 = c[2, 0, 1] - c[2, 1, 1]
+    x3 = c[3, 0, 0] - c[3, 1, 0]; y3 = c[3, 0, 1] - c[3, 1, 1]
+    x4 = c[4, 0, 0] - c[4, 1, 0]; y4 = c[4, 0, 1] - c[4, 1, 1]
+    x5 = c[5, 0, 0] - c[5, 1, 0]; y5 = c[5, 0, 1] - c[5, 1, 1]
+    d0 = math.sqrt(x0 * x0 + y0 * y0)
+    d1 = math.sqrt(x1 * x1 + y1 * y1)
+    d2 = math.sqrt(x2 * x2 + y2 * y2)
+    d3 = math.sqrt(x3 * x3 + y3 * y3)
+    d4 = math.sqrt(x4 * x4 + y4 * y4)
+    d5 = math.sqrt(x5 * x5 + y5 * y5)
+
+    left_ear = (d1 + d2) / (2.0 * d0) if d0 > 1e-6 else 0.0
+    right_ear = (d4 + d5) / (2.0 * d3) if d3 > 1e-6 else 0.0
+    return left_ear, right_ear
+
+def calculate_both_ears(pts):
+    """
+    Calculate the Eye Aspect Ratio (EAR) for both eyes in one pass.
+
+    Gathers the 12 landmarks needed by both eyes from the per-frame cached
+    coordinate array (see landmarks_to_ndarray) and hands them to the
+    JIT-compiled kernel. The kernel runs in single precision, so any
+    float64 input is downcast here rather than silently widening it.
+
+    Args:
+        pts: (N, 2) array of landmark pixel coordinates.
+
+    Returns:
+        tuple: (left_ear, right_ear) as floats.
+    """
+    if pts.dtype != np.float32:
+        pts = pts.astype(np.float32)
+    left_ear, right_ear = _ears_core(pts[EAR_INDEX_TABLE])
+    return float(left_ear), float(right_ear)
+
+def extract_eye_points(landmarks, indices, w, h):
+    """
+    Gather pixel coordinates for the given landmark indices in one pass.
+
+    Hoists the per-landmark attribute access out of the distance math so
+    each landmark is touched exactly once per call.
+
+    Args:
+        landmarks: MediaPipe normalized landmarks list (legacy container
+                   with a .landmark field).
+        indices: Iterable of landmark indices to extract.
+        w: Width of the image.
+        h: Height of the image.
+
+    Returns:
+        np.ndarray: (len(indices), 2) array of pixel coordinates.
+    """
+    lm = landmarks.landmark
+    return np.array([(lm[i].x * w, lm[i].y * h) for i in indices], dtype=np.float32)
+
 def calculate_ear(landmarks, horizontal_indices, vertical_indices, w, h):
     """
     Calculate the Eye Aspect Ratio (EAR).
-    
+
     The formula is: EAR = (||p2 - p6|| + ||p3 - p5||) / (2 * ||p1 - p4||)
     Where p1, p4 are horizontal landmarks and p2, p3, p5, p6 are vertical landmarks.
-    
+
     Args:
         landmarks: MediaPipe normalized landmarks list.
         horizontal_indices: List of 2 indices for horizontal points.
         vertical_indices: List of 2 tuples for vertical point pairs.
         w: Width of the image.
         h: Height of the image.
-        
+
     Returns:
-        float: Calculated EAR value.
-    """
-    try:
-        # Get pixel coordinates for horizontal points
-        horiz_pts = [np.array([landmarks.landmark[idx].x * w, landmarks.landmark[idx].y * h]) for idx in horizontal_indices]
-        
-        # Get pixel coordinates for vertical point pairs
-        vert_pts = []
-        for v1, v2 in vertical_indices:
-            v1_pt = np.array([landmarks.landmark[v1].x * w, landmarks.landmark[v1].y * h])
-            v2_pt = np.array([landmarks.landmark[v2].x * w, landmarks.landmark[v2].y * h])
-            vert_pts.append((v1_pt, v2_pt))
-
-        # Vertical distances (Euclidean)
-        v_dist1 = np.linalg.norm(vert_pts[0][0] - vert_pts[0][1])
-        v_dist2 = np.linalg.norm(vert_pts[1][0] - vert_pts[1][1])
-
-        # Horizontal distance (Euclidean)
-        h_dist = np.linalg.norm(horiz_pts[0] - horiz_pts[1])
-
-        # EAR calculation
-        ear = (v_dist1 + v_dist2) / (2.0 * h_dist)
-        return ear
-    except (IndexError, AttributeError) as e:
-        # Return 0 if landmarks are missing or malformed
-        return 0.0
+        float: Calculated EAR value, or 0.0 for a degenerate horizontal distance.
+    """
+    # One gather for all six points: rows 0-1 horizontal, 2-5 vertical pairs
+    indices = list(horizontal_indices) + [i for pair in vertical_indices for i in pair]
+    p = extract_eye_points(landmarks, indices, w, h)
+
+    # Euclidean distances via math.hypot on plain floats: for 2-D points
+    # this skips the ndarray subtract + generic norm ufunc chain entirely
+    v_dist1 = math.hypot(p[2, 0] - p[3, 0], p[2, 1] - p[3, 1])
+    v_dist2 = math.hypot(p[4, 0] - p[5, 0], p[4, 1] - p[5, 1])
+    h_dist = math.hypot(p[0, 0] - p[1, 0], p[0, 1] - p[1, 1])
+
+    # EAR calculation; explicit guard instead of a blanket except so real
+    # bugs surface and the function stays compilable
+    return (v_dist1 + v_dist2) / (2.0 * h_dist) if h_dist > 1e-6 else 0.0